@@ -1,9 +1,11 @@
-import json
+import orjson
 from datetime import datetime
 from dataclasses import dataclass
 from enum import Enum
 from typing import Dict, List, Optional
-from .ai_openai import generate_letter, analyze_final_gap
+from sqlalchemy import select, bindparam
+from models import db, Case
+from ai_openai import generate_letter, analyze_final_gap, generate_letter_and_analysis, AIResponseError
 
 class AuthorizationStatus(Enum):
     PENDING = "Pending"
@@ -41,55 +43,98 @@ class FinalAuthorizationRecord:
     rejection_reason: Optional[str]
     documents_submitted: List[str]
 
+inr = "₹{:,.2f}".format
+
+def dumps(obj, indent: bool = False) -> str:
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)).decode()
+
+def dump_record(rec) -> str:
+    # orjson serializes dataclasses, datetimes (ISO) and enums (value) natively
+    return dumps(rec)
+
+def load_record(cls, raw: Optional[str]):
+    if not raw:
+        return None
+    d = orjson.loads(raw)
+    for k in ("request_date", "approval_date"):
+        if d.get(k):
+            d[k] = datetime.fromisoformat(d[k])
+    d["approval_status"] = AuthorizationStatus(d["approval_status"])
+    return cls(**d)
+
+CASE_ROW_BY_CODE = select(Case).where(Case.case_code == bindparam("code"))
+
 class EnhancedTPAWithFinalAuth:
-    def __init__(self):
-        self.cases = {}
-        self.pre_authorizations = {}
-        self.final_authorizations = {}
-        self.discharge_records = {}
+    # state is kept on the cases row (keyed by case_code) rather than in process
+    # dicts, so it survives restarts and is consistent across gunicorn workers
 
     # NOTE: hospital_block/insurer_block are built by the Flask route (tenant aware)
 
+    def _case(self, case_id: str, for_update: bool = False) -> Optional[Case]:
+        stmt = CASE_ROW_BY_CODE
+        if for_update:
+            # row lock + fresh values, so read-modify-write of the JSON blobs can't lose updates
+            stmt = stmt.with_for_update().execution_options(populate_existing=True)
+        return db.session.execute(stmt, {"code": case_id}).scalar_one_or_none()
+
+    def _append_query(self, case_id: str, column: str, cls, query_content: str, html: str):
+        # the LLM call takes seconds: re-read under lock afterwards instead of
+        # writing back the copy loaded before it, which would drop concurrent replies
+        case = self._case(case_id, for_update=True)
+        rec = load_record(cls, getattr(case, column))
+        rec.queries.append({
+            "date": datetime.now().isoformat(),
+            "query": query_content,
+            "response": html
+        })
+        rec.approval_status = AuthorizationStatus.QUERY_REPLIED
+        setattr(case, column, dump_record(rec))
+        db.session.commit()
+
     def send_preauth_request(self, case_id: str, patient_data: Dict, estimated_cost: float):
-        self.cases[case_id] = patient_data
-        self.pre_authorizations[case_id] = PreAuthorizationRecord(
+        case = self._case(case_id)
+        if not case:
+            return {"error": "Case not found"}
+        case.patient_json = dumps(patient_data)
+        case.preauth_json = dump_record(PreAuthorizationRecord(
             case_id=case_id, request_date=datetime.now(),
             requested_amount=estimated_cost, approval_status=AuthorizationStatus.PENDING,
             approved_amount=None, approval_number=None, approval_date=None, queries=[], rejection_reason=None
-        )
+        ))
+        db.session.commit()
         return {"status": "pre_auth_sent", "case_id": case_id, "requested_amount": estimated_cost}
 
     def handle_preauth_query(self, case_id: str, query_content: str, hospital_block:str, insurer_block:str):
-        pre_auth = self.pre_authorizations.get(case_id)
+        case = self._case(case_id)
+        pre_auth = load_record(PreAuthorizationRecord, case.preauth_json) if case else None
         if not pre_auth:
             return {"error": "Pre-auth not found"}
         case_block = f"Query:\n{query_content}\n\nRespond point-wise with medical/policy justification."
         html = generate_letter(hospital_block, insurer_block, case_block, "pre-authorization")
-        pre_auth.queries.append({
-            "date": datetime.now().isoformat(),
-            "query": query_content,
-            "response": html
-        })
-        pre_auth.approval_status = AuthorizationStatus.QUERY_REPLIED
+        self._append_query(case_id, "preauth_json", PreAuthorizationRecord, query_content, html)
         return {"status": "query_replied", "response_html": html}
 
     def record_preauth_approval(self, case_id: str, approval_data: Dict):
-        pre_auth = self.pre_authorizations.get(case_id)
+        case = self._case(case_id, for_update=True)
+        pre_auth = load_record(PreAuthorizationRecord, case.preauth_json) if case else None
         if not pre_auth:
             return {"error": "Pre-auth not found"}
         pre_auth.approval_status = AuthorizationStatus.APPROVED
         pre_auth.approved_amount = approval_data["approved_amount"]
         pre_auth.approval_number = approval_data["approval_number"]
         pre_auth.approval_date = datetime.fromisoformat(approval_data["approval_date"])
+        case.preauth_json = dump_record(pre_auth)
+        db.session.commit()
         return {"status": "pre_auth_approved", "approved_amount": pre_auth.approved_amount}
 
     def generate_final_auth_request(self, case_id: str, discharge_data: Dict, hospital_block:str, insurer_block:str):
-        pre_auth = self.pre_authorizations.get(case_id)
-        patient = self.cases.get(case_id)
+        case = self._case(case_id)
+        pre_auth = load_record(PreAuthorizationRecord, case.preauth_json) if case else None
+        patient = orjson.loads(case.patient_json) if case and case.patient_json else None
         if not pre_auth or not patient:
             return {"error": "Pre-auth or patient data not found"}
 
-        self.discharge_records[case_id] = discharge_data
+        case.discharge_json = dumps(discharge_data)
         final_bill = discharge_data["final_bill_amount"]
         pre_auth_amount = pre_auth.approved_amount or 0
         additional_needed = max(0, final_bill - pre_auth_amount)
@@ -97,9 +142,9 @@ class EnhancedTPAWithFinalAuth:
         case_block = f"""
 CASE:
 - Patient: {patient.get('name','N/A')}
-- Pre-auth Approved: ₹{pre_auth_amount:,.2f} (Ref: {pre_auth.approval_number})
-- Final Bill: ₹{final_bill:,.2f}
-- Additional Needed: ₹{additional_needed:,.2f}
+- Pre-auth Approved: {inr(pre_auth_amount)} (Ref: {pre_auth.approval_number})
+- Final Bill: {inr(final_bill)}
+- Additional Needed: {inr(additional_needed)}
 
 DISCHARGE SUMMARY:
 - Admission: {discharge_data.get('admission_date')}
@@ -110,16 +155,16 @@ DISCHARGE SUMMARY:
 - Complications: {discharge_data.get('complications', 'None')}
 
 BILL BREAKDOWN:
-Room: ₹{discharge_data.get('room_charges',0):,.2f}
-Surgery: ₹{discharge_data.get('surgery_charges',0):,.2f}
-Pharmacy: ₹{discharge_data.get('pharmacy_charges',0):,.2f}
-Investigations: ₹{discharge_data.get('investigation_charges',0):,.2f}
-Doctor Fees: ₹{discharge_data.get('doctor_fees',0):,.2f}
-Others: ₹{discharge_data.get('other_charges',0):,.2f}
+Room: {inr(discharge_data.get('room_charges',0))}
+Surgery: {inr(discharge_data.get('surgery_charges',0))}
+Pharmacy: {inr(discharge_data.get('pharmacy_charges',0))}
+Investigations: {inr(discharge_data.get('investigation_charges',0))}
+Doctor Fees: {inr(discharge_data.get('doctor_fees',0))}
+Others: {inr(discharge_data.get('other_charges',0))}
 """
         html = generate_letter(hospital_block, insurer_block, case_block, "final authorization")
 
-        self.final_authorizations[case_id] = FinalAuthorizationRecord(
+        case.final_auth_json = dump_record(FinalAuthorizationRecord(
             case_id=case_id, request_date=datetime.now(), final_bill_amount=final_bill,
             pre_auth_approved=pre_auth_amount, additional_amount_requested=additional_needed,
             approval_status=AuthorizationStatus.PENDING, approved_amount=None,
@@ -127,12 +172,14 @@ Others: ₹{discharge_data.get('other_charges',0):,.2f}
             rejection_reason=None, documents_submitted=[
                 "Discharge Summary","Final Bill (itemized)","Investigation Reports","Pharmacy Bills","OT Notes","IPD Charts"
             ]
-        )
+        ))
+        db.session.commit()
         return {"status": "final_auth_generated", "request_letter_html": html, "additional_requested": additional_needed}
 
     def handle_final_auth_query(self, case_id: str, query_content: str, hospital_block:str, insurer_block:str):
-        final_auth = self.final_authorizations.get(case_id)
-        discharge = self.discharge_records.get(case_id)
+        case = self._case(case_id)
+        final_auth = load_record(FinalAuthorizationRecord, case.final_auth_json) if case else None
+        discharge = orjson.loads(case.discharge_json) if case and case.discharge_json else None
         if not final_auth or not discharge:
             return {"error": "Final auth or discharge data not found"}
         case_block = f"""FINAL AUTH QUERY:
@@ -142,16 +189,13 @@ Others: ₹{discharge_data.get('other_charges',0):,.2f}
 - Procedures: {', '.join(discharge.get('procedures', []))}
 Provide clear justification and list documents if needed."""
         html = generate_letter(hospital_block, insurer_block, case_block, "final authorization")
-        final_auth.queries.append({
-            "date": datetime.now().isoformat(),
-            "query": query_content,
-            "response": html
-        })
-        final_auth.approval_status = AuthorizationStatus.QUERY_REPLIED
+        self._append_query(case_id, "final_auth_json", FinalAuthorizationRecord, query_content, html)
         return {"status": "query_analyzed", "response_html": html}
 
-    def record_final_auth_approval(self, case_id: str, approval_data: Dict):
-        final_auth = self.final_authorizations.get(case_id)
+    def record_final_auth_approval(self, case_id: str, approval_data: Dict,
+                                   hospital_block: Optional[str] = None, insurer_block: Optional[str] = None):
+        case = self._case(case_id, for_update=True)
+        final_auth = load_record(FinalAuthorizationRecord, case.final_auth_json) if case else None
         if not final_auth:
             return {"error": "Final auth not found"}
         final_auth.approval_status = AuthorizationStatus.APPROVED
@@ -159,17 +203,39 @@ Provide clear justification and list documents if needed."""
         final_auth.approval_number = approval_data["approval_number"]
         final_auth.approval_date = datetime.fromisoformat(approval_data["approval_date"])
         final_auth.deductions = approval_data.get("deductions", {})
+        case.final_auth_json = dump_record(final_auth)
+        db.session.commit()
 
         billed = final_auth.final_bill_amount
         approved = final_auth.approved_amount
         gap = billed - approved
         gap_pct = (gap / billed * 100) if billed else 0.0
-        analysis = analyze_final_gap(billed, approved, json.dumps(final_auth.deductions, indent=2))
+        deductions_json = dumps(final_auth.deductions, indent=True)
+        letter_html = None
+        if hospital_block and insurer_block:
+            # caller wants the deduction response letter too: ask for both in one completion
+            case_block = f"""FINAL AUTH APPROVAL:
+- Approval No: {final_auth.approval_number}
+- Final Bill: {inr(billed)}
+- Approved: {inr(approved)}
+- Gap: {inr(gap)} ({gap_pct:.1f}%)
+- Deductions: {deductions_json}
+Acknowledge the approval and contest unjustified deductions point-wise."""
+            try:
+                letter_html, analysis = generate_letter_and_analysis(
+                    hospital_block, insurer_block, case_block, "final authorization",
+                    billed, approved, deductions_json)
+            except AIResponseError:
+                # combined reply unusable: still return the analysis on its own
+                analysis = analyze_final_gap(billed, approved, deductions_json)
+        else:
+            analysis = analyze_final_gap(billed, approved, deductions_json)
         return {
             "status": "final_auth_approved",
             "final_bill": billed, "approved_amount": approved,
             "gap_amount": gap, "gap_percentage": gap_pct,
             "deductions": final_auth.deductions,
             "ai_analysis": analysis,
+            "response_letter_html": letter_html,
             "requires_escalation": gap_pct > 20
         }
@@ -1,11 +1,132 @@
 import os
+import json
+import hashlib
+import threading
+from concurrent.futures import Future
+
+import httpx
+import redis
+from cachetools import TTLCache
 from openai import OpenAI
 
 MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+FINAL_MODEL = os.getenv("OPENAI_MODEL_FINAL", MODEL)
+# the gap analysis is a few bullets: keep it on the cheap tier whatever the phase
+ANALYSIS_MODEL = os.getenv("OPENAI_MODEL_ANALYSIS", MODEL)
+# decode time is linear in output tokens: letters ~1 page, analysis a few bullets
+LETTER_MAX_TOKENS = int(os.getenv("AI_LETTER_MAX_TOKENS", "900"))
+ANALYSIS_MAX_TOKENS = int(os.getenv("AI_ANALYSIS_MAX_TOKENS", "300"))
+CACHE_TTL = int(os.getenv("AI_CACHE_TTL", "86400"))
+REDIS_URL = os.getenv("REDIS_URL")
 
-def generate_letter(hospital_block: str, insurer_block: str, case_block: str, phase: str):
-    prompt = f"""
+# one HTTP/2 keep-alive pool per process: calls reuse the TLS session, and
+# under gevent workers each greenlet multiplexes onto it concurrently
+http_client = httpx.Client(http2=True, limits=httpx.Limits(max_connections=50, max_keepalive_connections=50))
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client, timeout=30, max_retries=2)
+rcache = redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
+# in-process tier in front of redis, expiring on the same TTL
+memo = TTLCache(maxsize=1024, ttl=CACHE_TTL)
+memo_lock = threading.Lock()
+
+class AIResponseError(RuntimeError):
+    pass
+
+def model_for(phase: str) -> str:
+    return FINAL_MODEL if phase.startswith("final") else MODEL
+
+def prompt_key(model: str, max_tokens: int, phase: str, prompt: str) -> str:
+    return hashlib.blake2b(f"{model}\x00{max_tokens}\x00{phase}\x00{prompt}".encode()).hexdigest()
+
+def _create(model: str, prompt: str, max_tokens: int, **extra):
+    return client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+        top_p=1,
+        presence_penalty=0,
+        max_tokens=max_tokens,
+        **extra,
+    )
+
+def _cache_get(key: str):
+    with memo_lock:
+        text = memo.get(key)
+    if text is not None or rcache is None:
+        return text
+    try:
+        hit = rcache.get(f"ai:{key}")
+    except redis.RedisError:
+        return None
+    if hit is None:
+        return None
+    text = hit.decode()
+    with memo_lock:
+        memo[key] = text
+    return text
+
+def _cache_set(key: str, text: str):
+    with memo_lock:
+        memo[key] = text
+    if rcache is None:
+        return
+    try:
+        rcache.setex(f"ai:{key}", CACHE_TTL, text)
+    except redis.RedisError:
+        pass
+
+# concurrent identical prompts in this process share one upstream call
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+def _singleflight(key: str, fn):
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        leader = fut is None
+        if leader:
+            fut = _inflight[key] = Future()
+    if not leader:
+        return fut.result()
+    try:
+        fut.set_result(fn())
+    except BaseException as e:
+        fut.set_exception(e)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+    return fut.result()
+
+def _fetch(key: str, prompt: str, model: str, max_tokens: int, json_mode: bool) -> str:
+    text = _cache_get(key)
+    if text is not None:
+        return text
+    extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+    resp = _create(model, prompt, max_tokens, **extra)
+    choice = resp.choices[0]
+    text = choice.message.content
+    if json_mode:
+        # a cut-off or unparseable object must not reach either cache tier
+        if choice.finish_reason == "length":
+            raise AIResponseError("json reply cut off at max_tokens")
+        try:
+            json.loads(text)
+        except ValueError as e:
+            raise AIResponseError("json reply did not parse") from e
+    if choice.finish_reason == "length":
+        return text  # cut off at max_tokens: usable once, not worth caching
+    _cache_set(key, text)
+    return text
+
+# temperature 0 keeps cached answers deterministic
+def _chat(phase: str, prompt: str, model: str, max_tokens: int, json_mode: bool = False) -> str:
+    key = prompt_key(model, max_tokens, phase, prompt)
+    with memo_lock:
+        text = memo.get(key)
+    if text is not None:
+        return text
+    return _singleflight(key, lambda: _fetch(key, prompt, model, max_tokens, json_mode))
+
+def letter_prompt(hospital_block: str, insurer_block: str, case_block: str, phase: str):
+    return f"""
 You are a hospital TPA desk writer. Draft a professional {phase} authorization email
 for cashless processing. Use neutral, clinical tone and clear sections.
 
@@ -15,12 +136,33 @@ for cashless processing. Use neutral, clinical tone and clear sections.
 
 {case_block}
 """
-    resp = client.chat.completions.create(
-        model=MODEL,
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.2,
-    )
-    return f"<pre>{resp.choices[0].message.content}</pre>"
+
+def generate_letter(hospital_block: str, insurer_block: str, case_block: str, phase: str):
+    prompt = letter_prompt(hospital_block, insurer_block, case_block, phase)
+    return f"<pre>{_chat(phase, prompt, model_for(phase), LETTER_MAX_TOKENS)}</pre>"
+
+def stream_letter(hospital_block: str, insurer_block: str, case_block: str, phase: str):
+    # yields raw text deltas; the full text lands in the shared cache at the end
+    prompt = letter_prompt(hospital_block, insurer_block, case_block, phase)
+    key = prompt_key(model_for(phase), LETTER_MAX_TOKENS, phase, prompt)
+    text = _cache_get(key)
+    if text is not None:
+        yield text
+        return
+    parts = []
+    finish_reason = None
+    # closing on exit releases the pooled connection even if the client goes away
+    with _create(model_for(phase), prompt, LETTER_MAX_TOKENS, stream=True) as stream:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+    if finish_reason == "stop":
+        _cache_set(key, "".join(parts))
 
 def analyze_final_gap(billed: float, approved: float, deductions_json: str):
     prompt = f"""
@@ -36,9 +178,36 @@ Return bullet points:
 3) Immediate actions
 4) Expected recovery
 """
-    resp = client.chat.completions.create(
-        model=MODEL,
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.2,
-    )
-    return resp.choices[0].message.content
+    return _chat("final-gap", prompt, ANALYSIS_MODEL, ANALYSIS_MAX_TOKENS)
+
+def generate_letter_and_analysis(hospital_block: str, insurer_block: str, case_block: str, phase: str,
+                                 billed: float, approved: float, deductions_json: str):
+    # one round-trip instead of generate_letter + analyze_final_gap
+    prompt = f"""
+You are a hospital TPA desk writer. Reply with a JSON object with exactly two string keys:
+"letter" and "analysis".
+
+"letter": a professional {phase} email for cashless processing. Use neutral, clinical tone
+and clear sections.
+
+{hospital_block}
+
+{insurer_block}
+
+{case_block}
+
+"analysis": an analysis of the final authorization result.
+
+BILLED: ₹{billed:,.2f}
+APPROVED: ₹{approved:,.2f}
+DEDUCTIONS: {deductions_json}
+
+Return bullet points:
+1) Acceptable gap? (<10% is OK)
+2) Escalation? (>20% act)
+3) Immediate actions
+4) Expected recovery
+"""
+    out = json.loads(_chat(f"{phase}+final-gap", prompt, model_for(phase),
+                           LETTER_MAX_TOKENS + ANALYSIS_MAX_TOKENS, json_mode=True))
+    return f"<pre>{out.get('letter', '')}</pre>", out.get("analysis", "")
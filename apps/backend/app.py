@@ -1,32 +1,78 @@
 import os
+import threading
 from datetime import timedelta, datetime
 from email.mime.text import MIMEText
-import smtplib
 
-from flask import Flask, jsonify, request
+import click
+import orjson
+from flask import Flask, Response, jsonify, request, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import select, and_, bindparam, inspect
+from flask_migrate import Migrate, stamp, upgrade
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt, get_jwt_identity
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+from cachetools import TTLCache, cached
+from cachetools.keys import hashkey
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError, InvalidHashError
+from redis import Redis, RedisError
+from rq import Queue
 
 from models import (
     db, Hospital, User, Insurer, HospitalInsurer, Case, Authorization, EmailLog,
     ROLE_SUPERADMIN, ROLE_HOSPITAL_ADMIN, ROLE_STAFF
 )
 from agent_v35 import EnhancedTPAWithFinalAuth
-from ai_openai import generate_letter
+from ai_openai import generate_letter, stream_letter
+from smtp_pool import SmtpPool
 
 DB_URL = os.getenv("DATABASE_URL", "sqlite:///tpa_saas.db")
 JWT_SECRET = os.getenv("JWT_SECRET_KEY", "dev-secret-change-me")
+REDIS_URL = os.getenv("REDIS_URL")
+EMAIL_LOG_PAGE = 200
+
+class ORJSONProvider(JSONProvider):
+    def dumps(self, obj, **_):
+        return orjson.dumps(obj, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **_):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 app.config.update(
     SQLALCHEMY_DATABASE_URI=DB_URL,
     SQLALCHEMY_TRACK_MODIFICATIONS=False,
-    JWT_SECRET_KEY=JWT_SECRET
+    JWT_SECRET_KEY=JWT_SECRET,
+    SQLALCHEMY_ENGINE_OPTIONS=dict(
+        pool_pre_ping=True, query_cache_size=1200,
+        **({} if DB_URL.startswith("sqlite") else {"pool_size": 20, "max_overflow": 10})
+    )
 )
 db.init_app(app)
+migrate = Migrate(app, db, directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations"),
+                  render_as_batch=True)
 jwt = JWTManager(app)
 agent = EnhancedTPAWithFinalAuth()
+# without redis (local dev) emails are sent inline
+email_queue = Queue("emails", connection=Redis.from_url(REDIS_URL)) if REDIS_URL else None
+smtp_pool = SmtpPool()
+ph = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+# prompt blocks keyed by row id + updated_at, so edits miss the cache immediately
+block_cache = TTLCache(maxsize=1024, ttl=300)
+block_lock = threading.Lock()
+
+# ---------- Statements ----------
+# built once at import; per request only the bound parameters change
+CASE_BY_CODE = (
+    select(Case, Hospital, Insurer, HospitalInsurer)
+    .join(Case.hospital).join(Case.insurer)
+    .outerjoin(HospitalInsurer, and_(HospitalInsurer.hospital_id==Case.hospital_id,
+                                     HospitalInsurer.insurer_id==Case.insurer_id))
+    .where(Case.case_code==bindparam("code"))
+)
+USER_BY_EMAIL = select(User).where(User.email==bindparam("email"))
 
 # ---------- Helpers ----------
 def claims(): return get_jwt()
@@ -45,15 +91,29 @@ def require_role(*roles):
         return inner
     return wrapper
 
-@jwt.additional_claims_loader
-def add_claims(identity):
-    user = User.query.get(identity)
-    return {"role": user.role, "hospital_id": user.hospital_id}
+def hash_password(pw:str)->str:
+    return ph.hash(pw)
+
+def verify_password(u:User, pw:str)->bool:
+    # legacy werkzeug pbkdf2 hashes are checked once and upgraded to argon2
+    if not u.password_hash.startswith("$argon2"):
+        if not check_password_hash(u.password_hash, pw):
+            return False
+        u.password_hash = hash_password(pw); db.session.commit()
+        return True
+    try:
+        ph.verify(u.password_hash, pw)
+    except (VerifyMismatchError, InvalidHashError):
+        return False
+    if ph.check_needs_rehash(u.password_hash):
+        u.password_hash = hash_password(pw); db.session.commit()
+    return True
 
 def tenant_ok(row_hid:int)->bool:
     hid = current_hid()
     return hid is None or hid == row_hid
 
+@cached(block_cache, key=lambda h: hashkey("h", h.id, h.updated_at), lock=block_lock)
 def hospital_block(h:Hospital)->str:
     return f"""Hospital:
 - Name: {h.name}
@@ -61,12 +121,18 @@ def hospital_block(h:Hospital)->str:
 - ROHINI: {h.rohini_id or 'N/A'}
 - Phone: {h.phone or 'N/A'}"""
 
-def insurer_block(hid:int, ins:Insurer)->str:
-    hi = HospitalInsurer.query.filter_by(hospital_id=hid, insurer_id=ins.id).first()
+@cached(block_cache, lock=block_lock,
+        key=lambda ins, hi: hashkey("i", ins.id, ins.updated_at, hi and hi.id, hi and hi.updated_at))
+def insurer_block(ins:Insurer, hi:HospitalInsurer|None)->str:
     return f"""Insurer:
 - Name: {ins.name}
 - Cashless Email: {(hi.cashless_email if hi else ins.default_email) or 'N/A'}"""
 
+def load_case(case_code:str):
+    # case + hospital + insurer + hospital/insurer link in one round-trip
+    row = db.session.execute(CASE_BY_CODE, {"code":case_code}).first()
+    return tuple(row) if row else (None, None, None, None)
+
 def resolve_sender(h:Hospital):
     # hospital-level sender first, else global fallback
     return dict(
@@ -85,13 +151,27 @@ def send_email(hospital:Hospital, to_email:str, subject:str, html:str):
     msg["From"] = f"{cfg['sender_name']} <{cfg['sender_email']}>"
     msg["To"] = to_email
     try:
-        with smtplib.SMTP_SSL(cfg["host"], cfg["port"]) as server:
-            server.login(cfg["user"], cfg["pwd"])
+        with smtp_pool.get(cfg) as server:
             server.send_message(msg)
         return True, None
     except Exception as e:
         return False, str(e)
 
+def deliver_email(log:EmailLog):
+    h = db.session.get(Hospital, log.hospital_id)
+    ok, err = send_email(h, log.to_email, log.subject, log.html)
+    log.sent_at = datetime.utcnow()
+    log.status = "sent" if ok else f"error:{err}"
+
+def send_email_job(log_id:int):
+    # runs in the rq worker: `rq worker -w rq.worker.SimpleWorker emails`; SimpleWorker
+    # keeps jobs in-process so the SMTP pool and app import survive across jobs
+    with app.app_context():
+        log = db.session.get(EmailLog, log_id)
+        if log and log.status == "queued":
+            deliver_email(log)
+            db.session.commit()
+
 # ---------- Routes ----------
 @app.get("/")
 def root():
@@ -99,26 +179,27 @@ def root():
 
 @app.post("/bootstrap/superadmin")
 def bootstrap():
-    with app.app_context():
-        db.create_all()
+    # schema comes from `flask db upgrade` (fly release_command), not this route
     if User.query.filter_by(role=ROLE_SUPERADMIN).first():
         return jsonify({"message":"superadmin_exists"})
     data = request.json or {"email":"admin@tpasaas.local","password":"Admin@123"}
-    u = User(email=data["email"], password_hash=generate_password_hash(data["password"]), role=ROLE_SUPERADMIN)
+    u = User(email=data["email"], password_hash=hash_password(data["password"]), role=ROLE_SUPERADMIN)
     db.session.add(u); db.session.commit()
     return jsonify({"message":"superadmin_created","email":u.email})
 
 @app.post("/auth/login")
 def login():
     data = request.json
-    u = User.query.filter_by(email=data["email"]).first()
-    if not u or not check_password_hash(u.password_hash, data["password"]):
+    u = db.session.execute(USER_BY_EMAIL, {"email":data["email"]}).scalar_one_or_none()
+    if not u or not verify_password(u, data["password"]):
         return jsonify({"error":"invalid_credentials"}), 401
     if u.role != ROLE_SUPERADMIN:
-        h = Hospital.query.get(u.hospital_id)
+        h = db.session.get(Hospital, u.hospital_id)
         if not h or not h.is_active:
             return jsonify({"error":"hospital_not_approved"}), 403
-    token = create_access_token(identity=u.id, expires_delta=timedelta(hours=12))
+    # role/hospital travel in the token so authenticated routes never re-read the user
+    token = create_access_token(identity=u.id, expires_delta=timedelta(hours=12),
+                                additional_claims={"role":u.role,"hospital_id":u.hospital_id})
     return jsonify({"access_token":token})
 
 @app.post("/auth/register_hospital")
@@ -141,7 +222,7 @@ def create_user():
     data = request.json
     role = claims().get("role")
     target_hid = data.get("hospital_id") if role==ROLE_SUPERADMIN else claims().get("hospital_id")
-    u = User(email=data["email"], password_hash=generate_password_hash(data["password"]),
+    u = User(email=data["email"], password_hash=hash_password(data["password"]),
              role=data.get("role", ROLE_STAFF), hospital_id=target_hid)
     db.session.add(u); db.session.commit()
     return jsonify({"id":u.id,"email":u.email,"role":u.role})
@@ -186,26 +267,37 @@ def create_case():
 @jwt_required()
 def ai_generate_letter_route():
     data = request.json
-    case = Case.query.filter_by(case_code=data["case_code"]).first()
+    case, h, ins, hi = load_case(data["case_code"])
     if not case or not tenant_ok(case.hospital_id):
         return jsonify({"error":"case_not_found_or_forbidden"}), 404
-    h = Hospital.query.get(case.hospital_id)
-    ins = Insurer.query.get(case.insurer_id)
-    html = generate_letter(hospital_block(h), insurer_block(h.id, ins),
-                           data.get("case_block",""), data.get("phase","pre-authorization"))
-    return jsonify({"html":html})
+    args = (hospital_block(h), insurer_block(ins, hi),
+            data.get("case_block",""), data.get("phase","pre-authorization"))
+    if data.get("stream"):
+        # server-sent events: one {"delta"} per chunk, then {"html"} with the whole letter,
+        # or an "error" event if the upstream fails part-way
+        def events():
+            parts = []
+            try:
+                for delta in stream_letter(*args):
+                    parts.append(delta)
+                    yield f"data: {app.json.dumps({'delta':delta})}\n\n"
+            except Exception:
+                app.logger.exception("letter stream failed")
+                yield f"event: error\ndata: {app.json.dumps({'error':'generation_failed'})}\n\n"
+                return
+            html = f"<pre>{''.join(parts)}</pre>"
+            yield f"event: done\ndata: {app.json.dumps({'html':html})}\n\n"
+        return Response(stream_with_context(events()), mimetype="text/event-stream")
+    return jsonify({"html":generate_letter(*args)})
 
 @app.post("/authorizations/request")
 @jwt_required()
 def send_authorization_email():
     data = request.json
-    case = Case.query.filter_by(case_code=data["case_code"]).first()
+    case, h, ins, hi = load_case(data["case_code"])
     if not case or not tenant_ok(case.hospital_id):
         return jsonify({"error":"case_not_found_or_forbidden"}), 404
 
-    h = Hospital.query.get(case.hospital_id)
-    ins = Insurer.query.get(case.insurer_id)
-    hi = HospitalInsurer.query.filter_by(hospital_id=h.id, insurer_id=ins.id).first()
     to_email = (hi.cashless_email if hi else ins.default_email)
     if not to_email:
         return jsonify({"error":"insurer_email_not_configured"}), 400
@@ -214,34 +306,100 @@ def send_authorization_email():
     html = data["html_body"]
 
     log = EmailLog(hospital_id=case.hospital_id, case_id=case.id,
-                   to_email=to_email, subject=subject, body_html=html, status="queued")
-    db.session.add(log); db.session.commit()
-
-    ok, err = send_email(h, to_email, subject, html)
-    log.sent_at = datetime.utcnow()
-    log.status = "sent" if ok else f"error:{err}"
-    db.session.commit()
-
+                   to_email=to_email, subject=subject, html=html, status="queued")
     auth = Authorization(case_id=case.id, hospital_id=case.hospital_id,
                          phase=data.get("phase","pre"), requested_amount=data.get("requested_amount"),
                          status="pending", details_json=data.get("details_json"))
-    db.session.add(auth); db.session.commit()
+    db.session.add_all([log, auth])
+    if email_queue is None:
+        deliver_email(log)  # no worker (local dev): send inline, inside the same transaction
+    db.session.flush()
+    out = {"to":to_email,"email_status":log.status,"email_log_id":log.id,"authorization_id":auth.id}
+    db.session.commit()
+    if email_queue is not None:
+        # only after commit, so the worker can see the row
+        try:
+            email_queue.enqueue("app.send_email_job", out["email_log_id"])
+        except RedisError:
+            # rows are already committed: report the failure instead of a 500 that invites a duplicate retry
+            app.logger.exception("enqueue failed for email_log %s", out["email_log_id"])
+            log.status = out["email_status"] = "error:enqueue"
+            db.session.commit()
 
-    return jsonify({"to":to_email,"email_status":log.status,"authorization_id":auth.id})
+    return jsonify(out)
 
 @app.get("/email_logs")
 @jwt_required()
 def email_logs():
+    # keyset pagination: pass the last id seen as ?cursor= for the next page
     hid = current_hid()
-    q = EmailLog.query if hid is None else EmailLog.query.filter_by(hospital_id=hid)
-    rows = q.order_by(EmailLog.id.desc()).limit(200).all()
-    return jsonify([
-        {"id":r.id,"case_id":r.case_id,"to":r.to_email,"subject":r.subject,
-         "status":r.status,"sent_at":(r.sent_at.isoformat() if r.sent_at else None)}
-        for r in rows
-    ])
+    limit = max(1, min(request.args.get("limit", EMAIL_LOG_PAGE, type=int), EMAIL_LOG_PAGE))
+    cursor = request.args.get("cursor", type=int)
+    stmt = select(EmailLog.id, EmailLog.case_id, EmailLog.to_email, EmailLog.subject,
+                  EmailLog.status, EmailLog.sent_at)
+    if hid is not None:
+        stmt = stmt.where(EmailLog.hospital_id==hid)
+    if cursor:
+        stmt = stmt.where(EmailLog.id < cursor)
+    stmt = stmt.order_by(EmailLog.id.desc()).limit(limit).execution_options(yield_per=50)
+
+    def generate():
+        yield "["
+        for i, r in enumerate(db.session.execute(stmt)):
+            yield ("," if i else "") + app.json.dumps(
+                {"id":r.id,"case_id":r.case_id,"to":r.to_email,"subject":r.subject,
+                 "status":r.status,"sent_at":(r.sent_at.isoformat() if r.sent_at else None)})
+        yield "]"
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+@app.get("/email_logs/<int:log_id>")
+@jwt_required()
+def email_log_status(log_id:int):
+    r = db.session.get(EmailLog, log_id)
+    if not r or not tenant_ok(r.hospital_id):
+        return jsonify({"error":"email_log_not_found_or_forbidden"}), 404
+    out = {"id":r.id,"case_id":r.case_id,"to":r.to_email,"subject":r.subject,
+           "status":r.status,"sent_at":(r.sent_at.isoformat() if r.sent_at else None)}
+    if request.args.get("include_body") == "1":
+        out["body_html"] = r.html
+    return jsonify(out)
+
+# what each migration after 0001 adds, in order; extend with every new revision
+SCHEMA_MARKERS = [
+    ("0002", lambda i: "ix_email_logs_hid_id" in {x["name"] for x in i.get_indexes("email_logs")}),
+    ("0003", lambda i: "patient_json" in {c["name"] for c in i.get_columns("cases")}),
+    ("0004", lambda i: "updated_at" in {c["name"] for c in i.get_columns("hospitals")}),
+    ("0005", lambda i: "body_html_zstd" in {c["name"] for c in i.get_columns("email_logs")}),
+]
+
+def unversioned_revision(insp)->str|None:
+    # revision an unversioned (db.create_all()) schema matches: migrations must
+    # be applied as a prefix, anything else is a hand-edited schema we won't guess at
+    present = [check(insp) for _, check in SCHEMA_MARKERS]
+    n = present.count(True)
+    if present != [True]*n + [False]*(len(present)-n):
+        return None
+    return SCHEMA_MARKERS[n-1][0] if n else "0001"
+
+@app.cli.command("release")
+def release():
+    # fly release_command: databases built by db.create_all() have tables but no
+    # alembic_version, so stamp them at the revision their schema matches first
+    insp = inspect(db.engine)
+    tables = set(insp.get_table_names())
+    if "cases" in tables and "alembic_version" not in tables:
+        rev = unversioned_revision(insp)
+        if rev is None:
+            raise click.ClickException(
+                "unversioned database does not match any migration; "
+                "inspect it and run `flask db stamp <revision>` by hand")
+        stamp(revision=rev)
+    upgrade()
 
 if __name__ == "__main__":
-    with app.app_context():
-        db.create_all()
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT",5000)), debug=True)
+    if os.getenv("AUTO_CREATE_TABLES") == "1":
+        # migrate rather than create_all, so the dev DB carries alembic_version
+        with app.app_context():
+            upgrade()
+    # local dev only; production runs gunicorn on wsgi:app
+    app.run(host="0.0.0.0", port=int(os.getenv("PORT",5000)), debug=os.getenv("FLASK_DEBUG")=="1")
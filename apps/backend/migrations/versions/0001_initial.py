@@ -0,0 +1,125 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-15 00:00:00
+
+Databases created earlier with db.create_all() already have these tables;
+`flask release` (the fly release_command) stamps them at 0001 before upgrading.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('hospitals',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.Column('address', sa.String(length=512), nullable=True),
+        sa.Column('rohini_id', sa.String(length=64), nullable=True),
+        sa.Column('phone', sa.String(length=32), nullable=True),
+        sa.Column('admin_contact', sa.String(length=128), nullable=True),
+        sa.Column('smtp_host', sa.String(length=255), nullable=True),
+        sa.Column('smtp_port', sa.Integer(), nullable=True),
+        sa.Column('smtp_user', sa.String(length=255), nullable=True),
+        sa.Column('smtp_pass', sa.String(length=255), nullable=True),
+        sa.Column('sender_name', sa.String(length=255), nullable=True),
+        sa.Column('sender_email', sa.String(length=255), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('is_data_opt_in', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('insurers',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.Column('default_email', sa.String(length=255), nullable=True),
+        sa.Column('notes', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    op.create_table('users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(length=255), nullable=False),
+        sa.Column('password_hash', sa.String(length=255), nullable=False),
+        sa.Column('role', sa.String(length=32), nullable=True),
+        sa.Column('hospital_id', sa.Integer(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(['hospital_id'], ['hospitals.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email')
+    )
+    op.create_table('hospital_insurers',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('hospital_id', sa.Integer(), nullable=False),
+        sa.Column('insurer_id', sa.Integer(), nullable=False),
+        sa.Column('mou_number', sa.String(length=128), nullable=True),
+        sa.Column('cashless_email', sa.String(length=255), nullable=True),
+        sa.Column('escalation_email', sa.String(length=255), nullable=True),
+        sa.Column('requires_final_auth', sa.Boolean(), nullable=True),
+        sa.Column('final_auth_deadline_days', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['hospital_id'], ['hospitals.id'], ),
+        sa.ForeignKeyConstraint(['insurer_id'], ['insurers.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('hospital_id', 'insurer_id', name='uq_hosp_insurer')
+    )
+    op.create_table('cases',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('case_code', sa.String(length=64), nullable=False),
+        sa.Column('hospital_id', sa.Integer(), nullable=False),
+        sa.Column('patient_name', sa.String(length=255), nullable=False),
+        sa.Column('insurer_id', sa.Integer(), nullable=False),
+        sa.Column('policy_no', sa.String(length=128), nullable=True),
+        sa.Column('status', sa.String(length=32), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['hospital_id'], ['hospitals.id'], ),
+        sa.ForeignKeyConstraint(['insurer_id'], ['insurers.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('case_code')
+    )
+    op.create_table('authorizations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('case_id', sa.Integer(), nullable=False),
+        sa.Column('hospital_id', sa.Integer(), nullable=False),
+        sa.Column('phase', sa.String(length=16), nullable=True),
+        sa.Column('requested_amount', sa.Float(), nullable=True),
+        sa.Column('approved_amount', sa.Float(), nullable=True),
+        sa.Column('approval_number', sa.String(length=128), nullable=True),
+        sa.Column('status', sa.String(length=32), nullable=True),
+        sa.Column('details_json', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['case_id'], ['cases.id'], ),
+        sa.ForeignKeyConstraint(['hospital_id'], ['hospitals.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('email_logs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('hospital_id', sa.Integer(), nullable=False),
+        sa.Column('case_id', sa.Integer(), nullable=True),
+        sa.Column('to_email', sa.String(length=255), nullable=False),
+        sa.Column('subject', sa.String(length=255), nullable=False),
+        sa.Column('body_html', sa.Text(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(length=32), nullable=True),
+        sa.Column('provider_message_id', sa.String(length=255), nullable=True),
+        sa.ForeignKeyConstraint(['case_id'], ['cases.id'], ),
+        sa.ForeignKeyConstraint(['hospital_id'], ['hospitals.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('email_logs')
+    op.drop_table('authorizations')
+    op.drop_table('cases')
+    op.drop_table('hospital_insurers')
+    op.drop_table('users')
+    op.drop_table('insurers')
+    op.drop_table('hospitals')
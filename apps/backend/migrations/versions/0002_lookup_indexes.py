@@ -0,0 +1,28 @@
+"""tenant listing and case lookup indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-15 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_email_logs_hid_id', 'email_logs', ['hospital_id', 'id'], unique=False)
+    op.create_index('ix_email_logs_case', 'email_logs', ['case_id'], unique=False)
+    op.create_index('ix_authorizations_case', 'authorizations', ['case_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_authorizations_case', table_name='authorizations')
+    op.drop_index('ix_email_logs_case', table_name='email_logs')
+    op.drop_index('ix_email_logs_hid_id', table_name='email_logs')
@@ -0,0 +1,32 @@
+"""agent state columns on cases
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-15 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('cases', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('patient_json', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('preauth_json', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('final_auth_json', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('discharge_json', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('cases', schema=None) as batch_op:
+        batch_op.drop_column('discharge_json')
+        batch_op.drop_column('final_auth_json')
+        batch_op.drop_column('preauth_json')
+        batch_op.drop_column('patient_json')
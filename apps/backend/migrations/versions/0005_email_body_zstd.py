@@ -0,0 +1,28 @@
+"""zstd-compressed email bodies
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-15 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('email_logs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('body_html_zstd', sa.LargeBinary(), nullable=True))
+        batch_op.alter_column('body_html', existing_type=sa.Text(), nullable=True)
+
+
+def downgrade():
+    with op.batch_alter_table('email_logs', schema=None) as batch_op:
+        batch_op.alter_column('body_html', existing_type=sa.Text(), nullable=False)
+        batch_op.drop_column('body_html_zstd')
@@ -1,5 +1,6 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+import zstandard as zstd
 
 db = SQLAlchemy()
 
@@ -25,6 +26,7 @@ class Hospital(db.Model):
     is_active = db.Column(db.Boolean, default=False)
     is_data_opt_in = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class User(db.Model):
     __tablename__ = "users"
@@ -41,6 +43,7 @@ class Insurer(db.Model):
     name = db.Column(db.String(255), unique=True, nullable=False)
     default_email = db.Column(db.String(255))
     notes = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class HospitalInsurer(db.Model):
     __tablename__ = "hospital_insurers"
@@ -52,6 +55,7 @@ class HospitalInsurer(db.Model):
     escalation_email = db.Column(db.String(255))
     requires_final_auth = db.Column(db.Boolean, default=True)
     final_auth_deadline_days = db.Column(db.Integer, default=7)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     __table_args__ = (db.UniqueConstraint("hospital_id","insurer_id", name="uq_hosp_insurer"),)
 
 class Case(db.Model):
@@ -64,6 +68,13 @@ class Case(db.Model):
     policy_no = db.Column(db.String(128))
     status = db.Column(db.String(32), default="preauth_pending")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # EnhancedTPAWithFinalAuth state, serialized so it is shared by all workers
+    patient_json = db.Column(db.Text)
+    preauth_json = db.Column(db.Text)
+    final_auth_json = db.Column(db.Text)
+    discharge_json = db.Column(db.Text)
+    hospital = db.relationship("Hospital")
+    insurer = db.relationship("Insurer")
 
 class Authorization(db.Model):
     __tablename__ = "authorizations"
@@ -77,6 +88,7 @@ class Authorization(db.Model):
     status = db.Column(db.String(32), default="pending")
     details_json = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.Index("ix_authorizations_case", "case_id"),)
 
 class EmailLog(db.Model):
     __tablename__ = "email_logs"
@@ -85,7 +97,24 @@ class EmailLog(db.Model):
     case_id = db.Column(db.Integer, db.ForeignKey("cases.id"), nullable=True)
     to_email = db.Column(db.String(255), nullable=False)
     subject = db.Column(db.String(255), nullable=False)
-    body_html = db.Column(db.Text, nullable=False)
+    # bodies load only when accessed; body_html holds rows from before compression
+    body_html = db.deferred(db.Column(db.Text), group="body")
+    body_html_zstd = db.deferred(db.Column(db.LargeBinary), group="body")
     sent_at = db.Column(db.DateTime)
     status = db.Column(db.String(32), default="queued")
     provider_message_id = db.Column(db.String(255))
+    # (hospital_id, id) serves the tenant-filtered newest-first listing as a range scan
+    __table_args__ = (db.Index("ix_email_logs_hid_id", "hospital_id", "id"),
+                      db.Index("ix_email_logs_case", "case_id"))
+
+    # letter html is stored zstd-compressed; read/write it through .html
+    @property
+    def html(self):
+        if self.body_html_zstd is not None:
+            return zstd.ZstdDecompressor().decompress(self.body_html_zstd).decode()
+        return self.body_html
+
+    @html.setter
+    def html(self, value):
+        self.body_html_zstd = zstd.ZstdCompressor(level=9).compress(value.encode())
+        self.body_html = None
@@ -0,0 +1,95 @@
+import os
+import smtplib
+import threading
+from contextlib import contextmanager
+
+IDLE_TIMEOUT = int(os.getenv("SMTP_IDLE_TIMEOUT", "300"))
+
+# keep-alive SMTP_SSL connections keyed by (host, port, user): login once, reuse
+# while the server answers NOOP, close after idle_timeout seconds unused
+class SmtpPool:
+
+    def __init__(self, idle_timeout: int = IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._conns = {}
+        self._locks = {}
+        self._timers = {}
+        self._guard = threading.Lock()
+
+    @staticmethod
+    def _key(cfg):
+        return (cfg["host"], cfg["port"], cfg["user"])
+
+    def _lock(self, key):
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def _connect(cfg):
+        server = smtplib.SMTP_SSL(cfg["host"], cfg["port"], timeout=30)
+        server.login(cfg["user"], cfg["pwd"])
+        return server
+
+    @staticmethod
+    def _alive(server) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    @staticmethod
+    def _close(server):
+        if server is None:
+            return
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    @staticmethod
+    def _broken(exc) -> bool:
+        # SMTPException subclasses OSError, so rule out protocol-level replies first
+        if isinstance(exc, smtplib.SMTPServerDisconnected):
+            return True
+        if isinstance(exc, smtplib.SMTPResponseException):
+            return exc.smtp_code == 421
+        if isinstance(exc, smtplib.SMTPException):
+            return False
+        return isinstance(exc, OSError)
+
+    def _schedule_evict(self, key):
+        timer = threading.Timer(self.idle_timeout, self._evict, (key,))
+        timer.daemon = True
+        self._timers[key] = timer
+        timer.start()
+
+    def _evict(self, key):
+        lock = self._lock(key)
+        if not lock.acquire(blocking=False):
+            return  # in use; the current holder reschedules on release
+        try:
+            self._timers.pop(key, None)
+            self._close(self._conns.pop(key, None))
+        finally:
+            lock.release()
+
+    @contextmanager
+    def get(self, cfg):
+        key = self._key(cfg)
+        with self._lock(key):
+            timer = self._timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            server = self._conns.get(key)
+            if server is None or not self._alive(server):
+                self._close(self._conns.pop(key, None))
+                server = self._conns[key] = self._connect(cfg)
+            try:
+                yield server
+            except Exception as e:
+                if self._broken(e):
+                    self._close(self._conns.pop(key, None))
+                raise
+            finally:
+                if key in self._conns:
+                    self._schedule_evict(key)
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# modules under test are imported top-level, as app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ.pop("REDIS_URL", None)
+# app.py binds its engine at import: point it at a throwaway file
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
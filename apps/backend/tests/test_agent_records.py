@@ -0,0 +1,49 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("flask_sqlalchemy")
+
+from agent_v35 import (
+    AuthorizationStatus, FinalAuthorizationRecord, PreAuthorizationRecord, dump_record, load_record,
+)
+
+QUERIES = [{"date": "2026-10-14T09:30:00", "query": "Share ICP notes", "response": "<pre>Attached</pre>"}]
+
+
+def preauth(approval_date):
+    return PreAuthorizationRecord(
+        case_id="C-1", request_date=datetime(2026, 10, 14, 9, 0, 0, 123456),
+        requested_amount=150000.0, approval_status=AuthorizationStatus.QUERY_REPLIED,
+        approved_amount=120000.5 if approval_date else None,
+        approval_number="PA-77" if approval_date else None,
+        approval_date=approval_date, queries=list(QUERIES), rejection_reason=None,
+    )
+
+
+def final_auth(approval_date):
+    return FinalAuthorizationRecord(
+        case_id="C-1", request_date=datetime(2026, 10, 15, 18, 45),
+        final_bill_amount=210000.0, pre_auth_approved=120000.5, additional_amount_requested=89999.5,
+        approval_status=AuthorizationStatus.PARTIALLY_APPROVED,
+        approved_amount=190000.0 if approval_date else None,
+        approval_number="FA-12" if approval_date else None,
+        approval_date=approval_date, queries=list(QUERIES),
+        deductions={"Non-payable consumables": 12500.0, "Room rent excess": 7500.25},
+        rejection_reason=None, documents_submitted=["Discharge Summary", "Final Bill (itemized)"],
+    )
+
+
+@pytest.mark.parametrize("make", [preauth, final_auth])
+@pytest.mark.parametrize("approval_date", [datetime(2026, 10, 16, 11, 5, 30), None])
+def test_record_round_trip(make, approval_date):
+    rec = make(approval_date)
+    loaded = load_record(type(rec), dump_record(rec))
+    assert loaded == rec
+    assert isinstance(loaded.approval_status, AuthorizationStatus)
+    assert isinstance(loaded.request_date, datetime)
+
+
+def test_missing_record_loads_as_none():
+    assert load_record(PreAuthorizationRecord, None) is None
+    assert load_record(FinalAuthorizationRecord, "") is None
@@ -0,0 +1,118 @@
+from types import SimpleNamespace
+
+import pytest
+
+import ai_openai
+
+
+def completion(text, finish_reason="stop"):
+    return SimpleNamespace(choices=[SimpleNamespace(
+        message=SimpleNamespace(content=text), finish_reason=finish_reason)])
+
+
+@pytest.fixture(autouse=True)
+def clear_memo():
+    ai_openai.memo.clear()
+    yield
+    ai_openai.memo.clear()
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    calls = []
+
+    def install(*replies):
+        def fake_create(model, prompt, max_tokens, **extra):
+            calls.append(extra)
+            return replies[min(len(calls), len(replies)) - 1]
+        monkeypatch.setattr(ai_openai, "_create", fake_create)
+        return calls
+    return install
+
+
+def combined():
+    return ai_openai.generate_letter_and_analysis("H", "I", "C", "final authorization", 100.0, 80.0, "{}")
+
+
+def test_truncated_json_is_not_cached(upstream):
+    calls = upstream(completion('{"letter": "Dear sir, this is trunc', "length"))
+    for _ in range(3):
+        with pytest.raises(ai_openai.AIResponseError):
+            combined()
+    assert len(calls) == 3
+    assert len(ai_openai.memo) == 0
+
+
+def test_unparseable_json_is_not_cached(upstream):
+    calls = upstream(completion("not json"), completion('{"letter": "L", "analysis": "A"}'))
+    with pytest.raises(ai_openai.AIResponseError):
+        combined()
+    assert combined() == ("<pre>L</pre>", "A")
+    assert combined() == ("<pre>L</pre>", "A")
+    assert len(calls) == 2
+
+
+def test_truncated_letter_is_returned_but_not_cached(upstream):
+    calls = upstream(completion("Dear sir, cut", "length"))
+    assert ai_openai.generate_letter("H", "I", "C", "pre-authorization") == "<pre>Dear sir, cut</pre>"
+    ai_openai.generate_letter("H", "I", "C", "pre-authorization")
+    assert len(calls) == 2
+    assert len(ai_openai.memo) == 0
+
+
+def test_complete_letter_is_cached(upstream):
+    calls = upstream(completion("Dear sir"))
+    ai_openai.generate_letter("H", "I", "C", "pre-authorization")
+    ai_openai.generate_letter("H", "I", "C", "pre-authorization")
+    assert len(calls) == 1
+
+
+def test_gap_analysis_uses_analysis_model(monkeypatch):
+    models = []
+    monkeypatch.setattr(ai_openai, "ANALYSIS_MODEL", "cheap-model")
+    monkeypatch.setattr(ai_openai, "_create",
+                        lambda model, prompt, max_tokens, **extra: models.append(model) or completion("- ok"))
+    ai_openai.analyze_final_gap(100.0, 80.0, "{}")
+    assert models == ["cheap-model"]
+
+
+class FakeStream:
+    def __init__(self, chunks, fail_after=None):
+        self.chunks, self.fail_after, self.closed = chunks, fail_after, False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.closed = True
+
+    def __iter__(self):
+        for i, (text, finish) in enumerate(self.chunks):
+            if i == self.fail_after:
+                raise RuntimeError("upstream reset")
+            yield SimpleNamespace(choices=[SimpleNamespace(
+                delta=SimpleNamespace(content=text), finish_reason=finish)])
+
+
+def test_stream_closed_when_client_disconnects(monkeypatch):
+    stream = FakeStream([("a", None), ("b", None), ("", "stop")])
+    monkeypatch.setattr(ai_openai, "_create", lambda *a, **k: stream)
+    gen = ai_openai.stream_letter("H", "I", "C", "pre-authorization")
+    assert next(gen) == "a"
+    gen.close()
+    assert stream.closed
+    assert len(ai_openai.memo) == 0
+
+
+def test_stream_error_closes_and_propagates(monkeypatch):
+    stream = FakeStream([("a", None), ("b", None)], fail_after=1)
+    monkeypatch.setattr(ai_openai, "_create", lambda *a, **k: stream)
+    with pytest.raises(RuntimeError):
+        list(ai_openai.stream_letter("H", "I", "C", "pre-authorization"))
+    assert stream.closed
+
+
+def test_stream_cached_only_on_stop(monkeypatch):
+    monkeypatch.setattr(ai_openai, "_create", lambda *a, **k: FakeStream([("a", None), ("b", "stop")]))
+    assert "".join(ai_openai.stream_letter("H", "I", "C", "pre-authorization")) == "ab"
+    assert list(ai_openai.memo.values()) == ["ab"]
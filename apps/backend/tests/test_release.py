@@ -0,0 +1,74 @@
+import pytest
+
+pytest.importorskip("flask_migrate")
+
+from flask_migrate import upgrade
+from sqlalchemy import text
+
+from app import app, db
+
+
+@pytest.fixture
+def ctx():
+    with app.app_context():
+        db.drop_all()
+        with db.engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS alembic_version"))
+        yield
+        db.session.remove()
+
+
+def unversion():
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP TABLE alembic_version"))
+
+
+def release():
+    return app.test_cli_runner().invoke(args=["release"])
+
+
+def version():
+    with db.engine.connect() as conn:
+        return conn.execute(text("SELECT version_num FROM alembic_version")).scalar()
+
+
+def test_baseline_schema_is_stamped_then_upgraded(ctx):
+    upgrade(revision="0001")
+    unversion()
+    result = release()
+    assert result.exit_code == 0, result.output
+    assert version() == "0005"
+
+
+def test_create_all_schema_is_stamped_at_head(ctx):
+    db.create_all()
+    result = release()
+    assert result.exit_code == 0, result.output
+    assert version() == "0005"
+
+
+def test_partly_migrated_schema_is_stamped_at_its_revision(ctx):
+    upgrade(revision="0003")
+    unversion()
+    result = release()
+    assert result.exit_code == 0, result.output
+    assert version() == "0005"
+
+
+def test_unrecognised_schema_fails_without_stamping(ctx):
+    upgrade(revision="0001")
+    unversion()
+    with db.engine.begin() as conn:
+        conn.execute(text("ALTER TABLE email_logs ADD COLUMN body_html_zstd BLOB"))
+    result = release()
+    assert result.exit_code != 0
+    assert "does not match any migration" in result.output
+    with db.engine.connect() as conn:
+        assert "alembic_version" not in db.inspect(conn).get_table_names()
+
+
+def test_versioned_database_just_upgrades(ctx):
+    upgrade(revision="0002")
+    result = release()
+    assert result.exit_code == 0, result.output
+    assert version() == "0005"
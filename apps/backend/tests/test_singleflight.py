@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+import ai_openai
+
+
+def run_concurrently(n, target):
+    barrier = threading.Barrier(n)
+    results, errors = [], []
+
+    def worker():
+        barrier.wait()
+        try:
+            results.append(target())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(n)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    return results, errors
+
+
+def test_concurrent_callers_share_one_upstream_call():
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return "letter"
+
+    results, errors = run_concurrently(8, lambda: ai_openai._singleflight("k", slow))
+    assert calls == [1]
+    assert results == ["letter"] * 8 and not errors
+    assert ai_openai._inflight == {}
+
+
+def test_leader_exception_reaches_every_caller():
+    calls = []
+
+    def failing():
+        calls.append(1)
+        time.sleep(0.2)
+        raise RuntimeError("upstream 500")
+
+    results, errors = run_concurrently(8, lambda: ai_openai._singleflight("k", failing))
+    assert calls == [1]
+    assert not results and len(errors) == 8
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    assert ai_openai._inflight == {}
+
+
+def test_next_call_after_failure_retries():
+    with pytest.raises(RuntimeError):
+        ai_openai._singleflight("k", lambda: (_ for _ in ()).throw(RuntimeError("boom")))
+    assert ai_openai._singleflight("k", lambda: "ok") == "ok"
@@ -0,0 +1,122 @@
+import smtplib
+import threading
+import time
+
+import pytest
+
+import smtp_pool
+from smtp_pool import SmtpPool
+
+CFG = {"host": "smtp.test", "port": 465, "user": "desk@test", "pwd": "pw"}
+
+
+class FakeSMTP:
+    instances = []
+
+    def __init__(self, host, port, timeout=None):
+        self.logins = 0
+        self.noop_error = None
+        self.closed = False
+        FakeSMTP.instances.append(self)
+
+    def login(self, user, pwd):
+        self.logins += 1
+
+    def noop(self):
+        if self.noop_error:
+            raise self.noop_error
+        return (250, b"OK")
+
+    def send_message(self, msg):
+        pass
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def fake_smtp(monkeypatch):
+    FakeSMTP.instances = []
+    monkeypatch.setattr(smtp_pool.smtplib, "SMTP_SSL", FakeSMTP)
+
+
+def test_connection_reused_without_relogin():
+    pool = SmtpPool(idle_timeout=60)
+    with pool.get(CFG) as a:
+        pass
+    with pool.get(CFG) as b:
+        pass
+    assert a is b
+    assert len(FakeSMTP.instances) == 1 and a.logins == 1
+
+
+def test_reconnect_after_noop_failure():
+    pool = SmtpPool(idle_timeout=60)
+    with pool.get(CFG) as first:
+        pass
+    first.noop_error = smtplib.SMTPServerDisconnected("gone")
+    with pool.get(CFG) as second:
+        pass
+    assert second is not first
+    assert first.closed and second.logins == 1
+
+
+def test_421_drops_connection():
+    pool = SmtpPool(idle_timeout=60)
+    with pytest.raises(smtplib.SMTPResponseException):
+        with pool.get(CFG) as first:
+            raise smtplib.SMTPResponseException(421, b"closing")
+    assert first.closed
+    with pool.get(CFG) as second:
+        pass
+    assert second is not first
+
+
+def test_other_errors_keep_connection():
+    pool = SmtpPool(idle_timeout=60)
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        with pool.get(CFG) as first:
+            raise smtplib.SMTPRecipientsRefused({})
+    with pool.get(CFG) as second:
+        pass
+    assert second is first and not first.closed
+
+
+def test_no_eviction_while_held():
+    pool = SmtpPool(idle_timeout=0.05)
+    key = SmtpPool._key(CFG)
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with pool.get(CFG):
+            held.set()
+            release.wait(2)
+
+    t = threading.Thread(target=hold)
+    t.start()
+    held.wait(2)
+    pool._evict(key)  # a timer firing now must back off
+    time.sleep(0.15)
+    server = pool._conns[key]
+    assert not server.closed
+    release.set()
+    t.join()
+    time.sleep(0.2)  # idle timer scheduled on release
+    assert server.closed and key not in pool._conns
+
+
+def test_concurrent_users_share_one_login():
+    pool = SmtpPool(idle_timeout=60)
+
+    def send():
+        with pool.get(CFG) as server:
+            time.sleep(0.01)
+            server.send_message(None)
+
+    threads = [threading.Thread(target=send) for _ in range(8)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert len(FakeSMTP.instances) == 1 and FakeSMTP.instances[0].logins == 1
@@ -0,0 +1,11 @@
+# gunicorn entrypoint only: gunicorn -k gevent -w 4 --worker-connections 200 wsgi:app
+# (the flask CLI uses FLASK_APP=app; it would otherwise pick this module first)
+# patch before anything imports socket/ssl/threading so OpenAI, SMTP and
+# postgres calls yield to other greenlets instead of blocking the worker
+from gevent import monkey
+monkey.patch_all()
+
+from psycogreen.gevent import patch_psycopg
+patch_psycopg()
+
+from app import app  # noqa: E402